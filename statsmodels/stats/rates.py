@@ -6,13 +6,44 @@ License: BSD-3
 '''
 
 
+from functools import lru_cache
+import math
+
 import numpy as np
-from scipy import stats
+from scipy import special, stats
 
-from statsmodels.stats.weightstats import _zstat_generic2
+from statsmodels.stats import proportion
 from statsmodels.stats.base import HolderTuple
 
 
+# accepted names of the alternatives and their standard name
+_alternative_names = {
+    'two-sided': 'two-sided',
+    '2-sided': 'two-sided',
+    '2s': 'two-sided',
+    'larger': 'larger',
+    'l': 'larger',
+    'smaller': 'smaller',
+    's': 'smaller',
+    }
+
+
+def _normalize_alternative(alternative):
+    """standard name of the alternative, raises ValueError if invalid"""
+    try:
+        return _alternative_names[alternative]
+    except KeyError:
+        raise ValueError('invalid alternative')
+
+
+# pvalues of a standard normal test statistic for each alternative
+_pvalue_normal_funcs = {
+    'two-sided': lambda z: 2 * special.ndtr(-np.abs(z)),
+    'larger': lambda z: special.ndtr(-z),
+    'smaller': lambda z: special.ndtr(z),
+    }
+
+
 def test_poisson_2indep(count1, exposure1, count2, exposure2, ratio_null=1,
                         method='score', alternative='two-sided',
                         etest_kwds=None):
@@ -30,15 +61,15 @@ def test_poisson_2indep(count1, exposure1, count2, exposure2, ratio_null=1,
 
     Parameters
     ----------
-    count1: int
+    count1: int or ndarray
         Number of events in first sample
-    exposure1: float
+    exposure1: float or ndarray
         Total exposure (time * subjects) in first sample
-    count2: int
+    count2: int or ndarray
         Number of events in first sample
-    exposure2: float
+    exposure2: float or ndarray
         Total exposure (time * subjects) in first sample
-    ratio: float
+    ratio: float or ndarray
         ratio of the two Poisson rates under the Null hypothesis. Default is 1.
     method: string
         Method for the test statistic and the p-value. Defaults to `'score'`.
@@ -73,6 +104,11 @@ def test_poisson_2indep(count1, exposure1, count2, exposure2, ratio_null=1,
     'etest': etest with score test statistic
     'etest-wald': etest with wald test statistic
 
+    The methods 'wald', 'score' and 'sqrt' are vectorized. Counts, exposures
+    and ratio_null can be numpy arrays that broadcast against each other,
+    for example to compare many pairs of samples in one call. Lists are not
+    converted. The statistic, pvalue, rates and ratio are then arrays.
+
     References
     ----------
     Gu, Ng, Tang, Schucany 2008: Testing the Ratio of Two Poisson Rates,
@@ -85,25 +121,24 @@ def test_poisson_2indep(count1, exposure1, count2, exposure2, ratio_null=1,
     d = n2 / n1
     r = ratio_null
     r_d = r / d
+    alt = _normalize_alternative(alternative)
 
-    if method in ['score']:
-        stat = (y1 - y2 * r_d) / np.sqrt((y1 + y2) * r_d)
-        dist = 'normal'
-    elif method in ['wald']:
-        stat = (y1 - y2 * r_d) / np.sqrt(y1 + y2 * r_d**2)
-        dist = 'normal'
-    elif method in ['sqrt']:
-        stat = 2 * (np.sqrt(y1 + 3 / 8.) - np.sqrt((y2 + 3 / 8.) * r_d))
-        stat /= np.sqrt(1 + r_d)
+    if method in ['score', 'wald', 'sqrt']:
+        stat = _stat_poisson_2indep_normal(y1, n1, y2, n2, ratio_null, method)
         dist = 'normal'
     elif method in ['exact-cond', 'cond-midp']:
-        from statsmodels.stats import proportion
         bp = r_d / (1 + r_d)
         y_total = y1 + y2
         stat = None
         # TODO: why y2 in here and not y1, check definition of H1 "larger"
-        pvalue = proportion.binom_test(y1, y_total, prop=bp,
-                                       alternative=alternative)
+        # one-sided pvalues directly, same as in proportion.binom_test
+        if alt == 'larger':
+            pvalue = stats.binom.sf(y1 - 1, y_total, bp)
+        elif alt == 'smaller':
+            pvalue = stats.binom.cdf(y1, y_total, bp)
+        else:
+            pvalue = proportion.binom_test(y1, y_total, prop=bp,
+                                           alternative=alt)
         if method in ['cond-midp']:
             # not inplace in case we still want binom pvalue
             pvalue = pvalue - 0.5 * stats.binom.pmf(y1, y_total, bp)
@@ -119,20 +154,29 @@ def test_poisson_2indep(count1, exposure1, count2, exposure2, ratio_null=1,
 
         stat, pvalue = etest_poisson_2indep(
             count1, exposure1, count2, exposure2, ratio_null=ratio_null,
-            method=method_etest, alternative=alternative, **etest_kwds)
+            method=method_etest, alternative=alt, **etest_kwds)
 
         dist = 'poisson'
     else:
         raise ValueError('method not recognized')
 
     if dist == 'normal':
-        stat, pvalue = _zstat_generic2(stat, 1, alternative)
+        pvalue = _pvalue_normal(stat, alt)
+
+    res = _results_poisson_2indep(stat, pvalue, dist, method, alternative,
+                                  count1, exposure1, count2, exposure2,
+                                  ratio_null)
+    return res
 
-    rates = (y1 / n1, y2 / n2)
+
+def _results_poisson_2indep(stat, pvalue, distribution, method, alternative,
+                            count1, exposure1, count2, exposure2, ratio_null):
+    """results instance for a test of the ratio of two Poisson rates"""
+    rates = (count1 / exposure1, count2 / exposure2)
     ratio = rates[0] / rates[1]
     res = HolderTuple(statistic=stat,
                       pvalue=pvalue,
-                      distribution=dist,
+                      distribution=distribution,
                       method=method,
                       alternative=alternative,
                       rates=rates,
@@ -141,6 +185,56 @@ def test_poisson_2indep(count1, exposure1, count2, exposure2, ratio_null=1,
     return res
 
 
+def _stat_poisson_2indep_normal(count1, exposure1, count2, exposure2,
+                                ratio_null, method):
+    """asymptotically normal test statistic for ratio of Poisson rates
+
+    The statistic is computed elementwise, so `ratio_null` can be an array
+    to compute statistics for several null hypotheses in one call.
+    """
+    y1, n1, y2, n2 = count1, exposure1, count2, exposure2
+    d = n2 / n1
+    r_d = ratio_null / d
+
+    if all(np.isscalar(x) for x in (y1, n1, y2, n2, r_d)):
+        # math.sqrt avoids the overhead of np.sqrt for scalars,
+        # numerator as numpy float to keep nan, inf for zero division
+        sqrt = math.sqrt
+        y1 = np.float64(y1)
+    else:
+        sqrt = np.sqrt
+
+    if method in ['score']:
+        stat = (y1 - y2 * r_d) / sqrt((y1 + y2) * r_d)
+    elif method in ['wald']:
+        stat = (y1 - y2 * r_d) / sqrt(y1 + y2 * (r_d * r_d))
+    elif method in ['sqrt']:
+        stat = 2 * (sqrt(y1 + 3 / 8.) - sqrt((y2 + 3 / 8.) * r_d))
+        stat /= sqrt(1 + r_d)
+    else:
+        raise ValueError('method not recognized')
+    return stat
+
+
+def _pvalue_normal(zstat, alternative):
+    """pvalue of a standard normal test statistic
+
+    alternative has to be one of the standard names 'two-sided', 'larger'
+    or 'smaller', see `_normalize_alternative`. For a scalar zstat this
+    uses math.erfc to avoid the overhead of numpy and scipy functions.
+    """
+    if not np.isscalar(zstat):
+        return _pvalue_normal_funcs[alternative](zstat)
+
+    if alternative == 'two-sided':
+        pvalue = math.erfc(abs(zstat) / math.sqrt(2))
+    elif alternative == 'larger':
+        pvalue = 0.5 * math.erfc(zstat / math.sqrt(2))
+    else:
+        pvalue = 0.5 * math.erfc(-zstat / math.sqrt(2))
+    return pvalue
+
+
 def etest_poisson_2indep(count1, exposure1, count2, exposure2, ratio_null=1,
                          method='score', alternative='2-sided', ygrid=None):
     """E-test for ratio of two sample Poisson rates
@@ -179,7 +273,7 @@ def etest_poisson_2indep(count1, exposure1, count2, exposure2, ratio_null=1,
     ygrid : None or 1-D ndarray
         Grid values for counts of the Poisson distribution used for computing
         the pvalue. By default truncation is based on an upper tail Poisson
-        quantiles.
+        quantiles. The grid values must be nonnegative integers.
 
     Returns
     -------
@@ -221,8 +315,10 @@ def etest_poisson_2indep(count1, exposure1, count2, exposure2, ratio_null=1,
         # rate1 = rate1_cmle
         # rate2 = rate2_cmle
     elif method in ['wald']:
+        r_d2 = r_d * r_d
+
         def stat_func(x1, x2):
-            return (x1 - x2 * r_d) / np.sqrt(x1 + x2 * r_d**2 + eps)
+            return (x1 - x2 * r_d) / np.sqrt(x1 + x2 * r_d2 + eps)
         # rate2_mle = y2 / n2
         # rate1_mle = y1 / n1
         # rate1 = rate1_mle
@@ -247,30 +343,134 @@ def etest_poisson_2indep(count1, exposure1, count2, exposure2, ratio_null=1,
     # We can make it depend on the amount of truncated sf.
     # Some numerical optimization or checks for large means need to be added.
     if ygrid is None:
-        threshold = stats.poisson.isf(1e-13, max(mean1, mean2))
-        threshold = max(threshold, 100)   # keep at least 100
+        threshold = _poisson_isf_threshold(round(max(mean1, mean2), 6))
         y_grid = np.arange(threshold + 1)
-    pdf1 = stats.poisson.pmf(y_grid, mean1)
-    pdf2 = stats.poisson.pmf(y_grid, mean2)
-
-    stat_space = stat_func(y_grid[:, None], y_grid[None, :])  # broadcasting
-    eps = 1e-15   # correction for strict inequality check
-
-    if alternative in ['two-sided', '2-sided', '2s']:
-        mask = np.abs(stat_space) >= np.abs(stat_sample) - eps
-    elif alternative in ['larger', 'l']:
-        mask = stat_space >= stat_sample - eps
-    elif alternative in ['smaller', 's']:
-        mask = stat_space <= stat_sample + eps
     else:
-        raise ValueError('invalid alternative')
+        y_grid = np.asarray(ygrid)
+        # the score denominators are looked up by the sum of counts
+        if np.any(y_grid < 0) or np.any(y_grid != np.floor(y_grid)):
+            raise ValueError('ygrid must contain nonnegative integers')
+    pdf1 = _poisson_pmf(y_grid, mean1)
+    pdf2 = _poisson_pmf(y_grid, mean2)
+
+    pvalue = _etest_pvalue(y_grid, pdf1, pdf2, r_d, stat_sample,
+                           method=method, alternative=alternative)
 
-    pvalue = ((pdf1[:, None] * pdf2[None, :])[mask]).sum()
     return stat_sample, pvalue
 
 
+@lru_cache(maxsize=1024)
+def _poisson_isf_threshold(mu):
+    """truncation point of the etest grid for a Poisson mean
+
+    Cached because the means are often repeated, e.g. in tost and in
+    simulations with the same total count.
+    """
+    # keep at least 100
+    return max(int(stats.poisson.isf(1e-13, mu)), 100)
+
+
+def _poisson_pmf(y, mu):
+    """pmf of the Poisson distribution for nonnegative integers y
+
+    Same as stats.poisson.pmf for nonnegative integers y, but without the
+    argument checking and broadcasting overhead of the distribution methods.
+    y is not checked, non-integer values do not have zero pmf.
+    """
+    # xlogy is zero if y = 0, this also handles mu = 0
+    return np.exp(special.xlogy(y, mu) - mu - special.gammaln(y + 1))
+
+
+# maximum number of grid cells that the etest evaluates in one block
+_ETEST_BLOCK_CELLS = 2**16
+
+
+# rejection region of the etest for each alternative, the mask is computed
+# inplace and stat is overwritten
+def _etest_mask_two_sided(stat, crit, mask):
+    np.abs(stat, out=stat)
+    np.greater_equal(stat, crit, out=mask)
+
+
+def _etest_mask_larger(stat, crit, mask):
+    np.greater_equal(stat, crit, out=mask)
+
+
+def _etest_mask_smaller(stat, crit, mask):
+    np.less_equal(stat, crit, out=mask)
+
+
+def _etest_pvalue(y_grid, pdf1, pdf2, r_d, stat_sample, method='score',
+                  alternative='two-sided'):
+    """pvalue of the E-test given the pmf of both samples on the grid
+
+    The pvalue is accumulated over blocks of rows of the grid. The block
+    size is chosen so that the intermediate arrays stay small, they are
+    allocated once and updated inplace within the loop.
+    """
+    eps = 1e-20  # avoid zero division in test statistic
+    eps_ineq = 1e-15   # correction for strict inequality check
+
+    alternative = _normalize_alternative(alternative)
+    if alternative == 'two-sided':
+        mask_func = _etest_mask_two_sided
+        crit = np.abs(stat_sample) - eps_ineq
+    elif alternative == 'larger':
+        mask_func = _etest_mask_larger
+        crit = stat_sample - eps_ineq
+    else:
+        mask_func = _etest_mask_smaller
+        crit = stat_sample + eps_ineq
+
+    y_grid = np.asarray(y_grid, dtype=np.float64)
+    n = len(y_grid)
+    y2_rd = y_grid * r_d
+    if method == 'wald':
+        y2_rd2 = y_grid * (r_d * r_d)
+    else:
+        # denominator of the score statistic only depends on y1 + y2,
+        # precompute it for all possible sums of counts on the grid
+        y_int = y_grid.astype(np.intp)
+        denom = np.sqrt(np.arange(2 * y_int.max() + 1) * r_d + eps)
+
+    block_size = max(1, min(n, _ETEST_BLOCK_CELLS // n))
+    stat = np.empty((block_size, n))
+    denom_block = np.empty((block_size, n))
+    # float mask, it is multiplied inplace by pdf2 in each block
+    mask = np.empty((block_size, n))
+    if method != 'wald':
+        idx = np.empty((block_size, n), dtype=np.intp)
+    # probability of y2 in rejection region for each y1
+    pdf2_reject = np.empty(n)
+
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        # views for the last block which can be shorter
+        m = stop - start
+        stat_b, denom_b, mask_b = stat[:m], denom_block[:m], mask[:m]
+
+        np.subtract(y_grid[start:stop, None], y2_rd, out=stat_b)
+        if method == 'wald':
+            np.add(y_grid[start:stop, None], y2_rd2, out=denom_b)
+            np.add(denom_b, eps, out=denom_b)
+            np.sqrt(denom_b, out=denom_b)
+        else:
+            np.add(y_int[start:stop, None], y_int, out=idx[:m])
+            np.take(denom, idx[:m], out=denom_b)
+        np.divide(stat_b, denom_b, out=stat_b)
+        mask_func(stat_b, crit, mask_b)
+        # sum uses pairwise summation, which is more accurate than dot
+        np.multiply(mask_b, pdf2, out=mask_b)
+        pdf2_reject[start:stop] = mask_b.sum(1)
+
+    # compensated summation of many small terms, pvalues at different
+    # ratio_null, e.g. in tost, can be close to each other
+    pvalue = math.fsum(pdf1 * pdf2_reject)
+    return pvalue
+
+
 def tost_poisson_2indep(count1, exposure1, count2, exposure2, low, upp,
-                        method='score'):
+                        method='score', short_circuit_alpha=None):
     '''Equivalence test based on two one-sided `test_proportions_2indep`
 
     This assumes that we have two independent binomial samples.
@@ -300,15 +500,25 @@ def tost_poisson_2indep(count1, exposure1, count2, exposure2, low, upp,
         Implemented are 'wald', 'score' and 'sqrt' based asymptotic normal
         distribution, and the exact conditional test 'exact-cond', and its
         mid-point version 'cond-midp', see Notes
+    short_circuit_alpha : None or float
+        If not None and the pvalue of the one-sided test at the lower margin
+        is larger or equal to short_circuit_alpha, then the test at the
+        upper margin is not computed. Equivalence cannot be rejected at
+        this level in that case. With array inputs the second test is only
+        skipped if this holds for all elements. For 'wald', 'score' and
+        'sqrt' with scalar inputs both statistics are computed in one call,
+        but only the first test is returned.
 
     Returns
     -------
     pvalue : float
-        p-value is the max of the pvalues of the two one-sided tests
+        p-value is the max of the pvalues of the two one-sided tests. If the
+        second test is skipped, then this is the pvalue of the first test.
     t1 : test results
         results instance for one-sided hypothesis at the lower margin
-    t1 : test results
-        results instance for one-sided hypothesis at the upper margin
+    t2 : test results or None
+        results instance for one-sided hypothesis at the upper margin,
+        None if it is skipped because of short_circuit_alpha.
 
     Notes
     -----
@@ -329,11 +539,33 @@ def tost_poisson_2indep(count1, exposure1, count2, exposure2, low, upp,
 
     '''
 
-    tt1 = test_poisson_2indep(count1, exposure1, count2, exposure2,
-                              ratio_null=low, method=method,
-                              alternative='larger')
-    tt2 = test_poisson_2indep(count1, exposure1, count2, exposure2,
-                              ratio_null=upp, method=method,
-                              alternative='smaller')
+    args = (count1, exposure1, count2, exposure2)
+    scalar_inputs = all(np.isscalar(x) for x in args + (low, upp))
+    fused = method in ['wald', 'score', 'sqrt'] and scalar_inputs
+    if fused:
+        # both one-sided tests only differ in ratio_null, compute the
+        # statistics at both margins in one vectorized call
+        stat = _stat_poisson_2indep_normal(*args, np.array([low, upp]),
+                                           method)
+        pvalue_low = _pvalue_normal(stat[0], 'larger')
+        tt1 = _results_poisson_2indep(stat[0], pvalue_low, 'normal', method,
+                                      'larger', *args, low)
+    else:
+        tt1 = test_poisson_2indep(count1, exposure1, count2, exposure2,
+                                  ratio_null=low, method=method,
+                                  alternative='larger')
+
+    if (short_circuit_alpha is not None and
+            np.all(tt1.pvalue >= short_circuit_alpha)):
+        return tt1.pvalue, tt1, None
+
+    if fused:
+        pvalue_upp = _pvalue_normal(stat[1], 'smaller')
+        tt2 = _results_poisson_2indep(stat[1], pvalue_upp, 'normal', method,
+                                      'smaller', *args, upp)
+    else:
+        tt2 = test_poisson_2indep(count1, exposure1, count2, exposure2,
+                                  ratio_null=upp, method=method,
+                                  alternative='smaller')
 
     return np.maximum(tt1.pvalue, tt2.pvalue), tt1, tt2
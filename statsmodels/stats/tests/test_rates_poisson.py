@@ -1,7 +1,9 @@
 
 
+import numpy as np
 import pytest
 from numpy.testing import assert_allclose, assert_equal
+from scipy import stats
 
 # we cannot import test_poisson_2indep directly, pytest treats that as test
 import statsmodels.stats.rates as smr
@@ -245,3 +247,238 @@ def test_alternative(case):
     _, pv = smr.test_poisson_2indep(count1, n1, count2, n2, method=meth,
                                     ratio_null=1.2, alternative=alt)
     assert_allclose(pv, cases_alt[case], rtol=1e-13)
+
+
+def test_etest_ygrid():
+    count1, n1, count2, n2 = 60, 51477.5, 30, 54308.7
+    for alt in ['two-sided', 'larger', 'smaller']:
+        res1 = etest_poisson_2indep(count1, n1, count2, n2, ratio_null=1.2,
+                                    alternative=alt)
+        res2 = etest_poisson_2indep(count1, n1, count2, n2, ratio_null=1.2,
+                                    alternative=alt, ygrid=np.arange(201))
+        assert_allclose(res2, res1, rtol=1e-10)
+
+
+def test_etest_ygrid_invalid():
+    count1, n1, count2, n2 = 60, 51477.5, 30, 54308.7
+    for ygrid in [np.arange(0, 200, 0.5), np.arange(-5, 200)]:
+        with pytest.raises(ValueError, match='nonnegative integers'):
+            etest_poisson_2indep(count1, n1, count2, n2, ygrid=ygrid)
+
+
+@pytest.mark.parametrize('meth', ['wald', 'score', 'sqrt'])
+def test_tost_poisson_vectorized(meth):
+    # tost computes both margins in one call for normal based methods
+    count1, n1, count2, n2 = 60, 51477.5, 30, 54308.7
+    low, upp = 1.2, 2.5
+
+    pv, tt1, tt2 = smr.tost_poisson_2indep(count1, n1, count2, n2, low, upp,
+                                           method=meth)
+    res1 = smr.test_poisson_2indep(count1, n1, count2, n2, ratio_null=low,
+                                   method=meth, alternative='larger')
+    res2 = smr.test_poisson_2indep(count1, n1, count2, n2, ratio_null=upp,
+                                   method=meth, alternative='smaller')
+    assert_allclose(tt1.statistic, res1.statistic, rtol=1e-13)
+    assert_allclose(tt1.pvalue, res1.pvalue, rtol=1e-13)
+    assert_allclose(tt2.statistic, res2.statistic, rtol=1e-13)
+    assert_allclose(tt2.pvalue, res2.pvalue, rtol=1e-13)
+    assert_equal(tt1.alternative, 'larger')
+    assert_equal(tt2.ratio_null, upp)
+    assert_allclose(pv, max(res1.pvalue, res2.pvalue), rtol=1e-13)
+
+
+@pytest.mark.parametrize('meth', ['wald', 'score', 'sqrt', 'exact-cond'])
+def test_tost_poisson_array(meth):
+    # array inputs are tested elementwise
+    count1 = np.array([60, 41, 25])
+    n1 = np.array([51477.5, 28010, 20000])
+    count2 = np.array([30, 15, 31])
+    n2 = np.array([54308.7, 19017, 21000])
+    low = np.array([0.8, 1.2, 0.5])
+    upp = 3
+
+    # length 2 arrays must not be confused with the two margins
+    for k, low_ in [(3, low), (3, 1.2), (2, 1.2)]:
+        count1, n1, count2, n2 = [x[:k] for x in (count1, n1, count2, n2)]
+        pv, tt1, tt2 = smr.tost_poisson_2indep(count1, n1, count2, n2, low_,
+                                               upp, method=meth)
+        assert pv.shape == (k,)
+        low_ = np.broadcast_to(low_, count1.shape)
+        for i in range(k):
+            res = smr.tost_poisson_2indep(count1[i], n1[i], count2[i], n2[i],
+                                          low_[i], upp, method=meth)
+            assert_allclose(pv[i], res[0], rtol=1e-13)
+            assert_allclose(tt1.pvalue[i], res[1].pvalue, rtol=1e-13)
+            assert_allclose(tt2.pvalue[i], res[2].pvalue, rtol=1e-13)
+
+
+@pytest.mark.parametrize('alt', ['two-sided', 'larger', 'smaller'])
+@pytest.mark.parametrize('meth', ['wald', 'score', 'sqrt'])
+def test_scalar_array(meth, alt):
+    # scalar inputs use math functions, compare with array computation
+    count1, n1, count2, n2 = 41, 28010, 15, 19017
+    res1 = smr.test_poisson_2indep(count1, n1, count2, n2, method=meth,
+                                   ratio_null=1.5, alternative=alt)
+    res2 = smr.test_poisson_2indep(np.array([count1]), n1, count2, n2,
+                                   method=meth, ratio_null=1.5,
+                                   alternative=alt)
+    assert_allclose(res1.statistic, res2.statistic[0], rtol=1e-13)
+    assert_allclose(res1.pvalue, res2.pvalue[0], rtol=1e-13)
+
+
+def _etest_full_grid(count1, n1, count2, n2, ratio_null, meth, alt, stat,
+                     n_grid):
+    # etest pvalue on a large square grid by broadcasting
+    r_d = ratio_null / (n2 / n1)
+    mean2 = (count1 + count2) / (1 + r_d)
+    mean1 = mean2 * r_d
+    y = np.arange(float(n_grid))
+    x1, x2 = y[:, None], y[None, :]
+    eps = 1e-20
+    if meth == 'score':
+        stat_space = (x1 - x2 * r_d) / np.sqrt((x1 + x2) * r_d + eps)
+    else:
+        stat_space = (x1 - x2 * r_d) / np.sqrt(x1 + x2 * r_d**2 + eps)
+    if alt == 'two-sided':
+        mask = np.abs(stat_space) >= np.abs(stat) - 1e-15
+    elif alt == 'larger':
+        mask = stat_space >= stat - 1e-15
+    else:
+        mask = stat_space <= stat + 1e-15
+    pdf = (stats.poisson.pmf(y, mean1)[:, None] *
+           stats.poisson.pmf(y, mean2)[None, :])
+    return pdf[mask].sum()
+
+
+@pytest.mark.parametrize('alt', ['two-sided', 'larger', 'smaller'])
+@pytest.mark.parametrize('meth', ['wald', 'score'])
+def test_etest_blocks(meth, alt):
+    # large grid is evaluated in several blocks, compare with full grid
+    count1, n1, count2, n2 = 600, 51477.5, 300, 54308.7
+    ratio_null = 2.1
+    stat, pv = etest_poisson_2indep(count1, n1, count2, n2,
+                                    ratio_null=ratio_null, method=meth,
+                                    alternative=alt)
+    pv2 = _etest_full_grid(count1, n1, count2, n2, ratio_null, meth, alt,
+                           stat, 1201)
+    assert_allclose(pv, pv2, rtol=1e-10)
+
+
+@pytest.mark.parametrize('meth', ['wald', 'score'])
+def test_etest_small_pvalue(meth):
+    # small pvalue depends on the far tails of the grid
+    count1, n1, count2, n2 = 60, 51477.5, 30, 54308.7
+    ratio_null = 0.5
+    stat, pv = etest_poisson_2indep(count1, n1, count2, n2,
+                                    ratio_null=ratio_null, method=meth,
+                                    alternative='larger')
+    pv2 = _etest_full_grid(count1, n1, count2, n2, ratio_null, meth,
+                           'larger', stat, 600)
+    assert pv < 1e-10
+    assert_allclose(pv, pv2, rtol=1e-10)
+    if meth == 'score':
+        assert_allclose(pv, 1.178905e-11, rtol=1e-6)
+
+
+def test_etest_tiny_pvalue():
+    # pvalue far below the pmf of most grid points
+    count1, n1, count2, n2 = 200, 10, 2, 10
+    ratio_null = 2
+    stat, pv = etest_poisson_2indep(count1, n1, count2, n2,
+                                    ratio_null=ratio_null,
+                                    alternative='two-sided')
+    pv2 = _etest_full_grid(count1, n1, count2, n2, ratio_null, 'score',
+                           'two-sided', stat, 600)
+    assert 0 < pv < 1e-18
+    assert_allclose(pv, pv2, rtol=1e-10)
+
+    # regression test, value of the original broadcasting implementation
+    _, pv = etest_poisson_2indep(count1, n1, count2, n2,
+                                 ratio_null=ratio_null, method='wald',
+                                 alternative='two-sided')
+    assert_allclose(pv, 3.6315787098221266e-33, rtol=1e-10)
+
+
+def test_tost_poisson_etest():
+    # large counts, tost agrees with the two one-sided tests
+    count1, n1, count2, n2 = 600, 51477.5, 300, 54308.7
+    low, upp = 1.5, 2.5
+    pv, tt1, tt2 = smr.tost_poisson_2indep(count1, n1, count2, n2, low, upp,
+                                           method='etest')
+    res1 = smr.test_poisson_2indep(count1, n1, count2, n2, ratio_null=low,
+                                   method='etest', alternative='larger')
+    res2 = smr.test_poisson_2indep(count1, n1, count2, n2, ratio_null=upp,
+                                   method='etest', alternative='smaller')
+    assert_allclose(tt1.pvalue, res1.pvalue, rtol=1e-13)
+    assert_allclose(tt2.pvalue, res2.pvalue, rtol=1e-13)
+    assert_allclose(pv, max(res1.pvalue, res2.pvalue), rtol=1e-13)
+
+
+@pytest.mark.parametrize('meth', ['wald', 'score', 'sqrt'])
+def test_poisson_2indep_vectorized(meth):
+    count1 = np.array([60, 41, 6, 25])
+    n1 = np.array([51477.5, 28010, 51., 1000])
+    count2 = np.array([30, 15, 1, 31])
+    n2 = np.array([54308.7, 19017, 54., 1200])
+    ratio_null = np.array([1, 1.5, 1.2, 0.9])
+
+    res = smr.test_poisson_2indep(count1, n1, count2, n2,
+                                  ratio_null=ratio_null, method=meth)
+    for i in range(len(count1)):
+        res_i = smr.test_poisson_2indep(count1[i], n1[i], count2[i], n2[i],
+                                        ratio_null=ratio_null[i],
+                                        method=meth)
+        assert_allclose(res.statistic[i], res_i.statistic, rtol=1e-13)
+        assert_allclose(res.pvalue[i], res_i.pvalue, rtol=1e-13)
+        assert_allclose(res.ratio[i], res_i.ratio, rtol=1e-13)
+
+
+def test_tost_poisson_short_circuit():
+    count1, n1, count2, n2 = 60, 51477.5, 30, 54308.7
+    # first tail does not reject, second test is skipped
+    low, upp = 2.5, 3.5
+    for meth in ['exact-cond', 'score', 'wald', 'sqrt']:
+        pv, tt1, tt2 = smr.tost_poisson_2indep(count1, n1, count2, n2, low,
+                                               upp, method=meth,
+                                               short_circuit_alpha=0.05)
+        assert tt2 is None
+        assert_allclose(pv, tt1.pvalue, rtol=1e-13)
+        assert pv >= 0.05
+
+    # first tail rejects, both tests are computed
+    low, upp = 1.2, 3.5
+    for meth in ['exact-cond', 'score']:
+        res = smr.tost_poisson_2indep(count1, n1, count2, n2, low, upp,
+                                      method=meth, short_circuit_alpha=0.05)
+        res2 = smr.tost_poisson_2indep(count1, n1, count2, n2, low, upp,
+                                       method=meth)
+        assert res[2] is not None
+        assert_allclose(res[0], res2[0], rtol=1e-13)
+
+    # arrays, second test is skipped only if no element rejects
+    low = np.array([2.5, 3])
+    res = smr.tost_poisson_2indep(count1, n1, count2, n2, low, upp,
+                                  short_circuit_alpha=0.05)
+    assert res[2] is None
+    assert np.all(res[0] >= 0.05)
+
+    low = np.array([1.2, 2.5])
+    res = smr.tost_poisson_2indep(count1, n1, count2, n2, low, upp,
+                                  short_circuit_alpha=0.05)
+    res2 = smr.tost_poisson_2indep(count1, n1, count2, n2, low, upp)
+    assert res[2] is not None
+    assert_allclose(res[0], res2[0], rtol=1e-13)
+
+
+@pytest.mark.parametrize('meth', ['score', 'exact-cond', 'etest'])
+def test_alternative_names(meth):
+    count1, n1, count2, n2 = 6, 51., 1, 54.
+    for alt, alt_short in [('two-sided', '2s'), ('two-sided', '2-sided'),
+                           ('larger', 'l'), ('smaller', 's')]:
+        _, pv = smr.test_poisson_2indep(count1, n1, count2, n2, method=meth,
+                                        ratio_null=1.2, alternative=alt_short)
+        assert_allclose(pv, cases_alt[(alt, meth)], rtol=1e-13)
+
+    with pytest.raises(ValueError, match='invalid alternative'):
+        smr.test_poisson_2indep(count1, n1, count2, n2, method=meth,
+                                alternative='bigger')